@@ -1,9 +1,12 @@
 import django.utils.version
 
 from .constants import DEFAULT_PROTOCOL
-from .fields import PickledObjectField
+from .fields import PickledBinaryField, PickledObjectField
 
-__all__ = 'VERSION', '__version__', 'DEFAULT_PROTOCOL', 'PickledObjectField'
+__all__ = (
+    'VERSION', '__version__', 'DEFAULT_PROTOCOL', 'PickledBinaryField',
+    'PickledObjectField',
+)
 
 VERSION = (3, 1, 0, 'final', 0)
 
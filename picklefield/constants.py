@@ -1 +1,5 @@
-DEFAULT_PROTOCOL = 2
+# Pinned rather than set to pickle.HIGHEST_PROTOCOL so that the encoded
+# values, and therefore ``exact`` and ``in`` lookups, don't change when the
+# Python interpreter is upgraded. Protocol 5 is available on all supported
+# Python versions.
+DEFAULT_PROTOCOL = 5
@@ -1,15 +1,71 @@
-from base64 import b64decode, b64encode
-from copy import deepcopy
+from binascii import a2b_base64, b2a_base64
+from functools import partial
 from pickle import dumps, loads
-from zlib import compress, decompress
+from zlib import compress
 
 from django.conf import settings
 from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models
-from django.utils.encoding import force_str
+from django.db.models.query_utils import DeferredAttribute
 
 from .constants import DEFAULT_PROTOCOL
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The zlib stream format is shared by these implementations so any of them can
+# be used to decompress values. Compression always goes through the standard
+# zlib module as the other implementations produce different (yet compatible)
+# streams which would break ``exact`` and ``in`` lookups.
+try:
+    from isal.isal_zlib import decompress
+except ImportError:
+    try:
+        from zlib_ng.zlib_ng import decompress
+    except ImportError:
+        from zlib import decompress
+
+# Compressing smaller payloads usually makes them larger.
+_COMPRESS_THRESHOLD = 256
+# First byte of streams produced by zlib.compress(); pickles never start with
+# it since it isn't a pickle opcode.
+_ZLIB_MAGIC = b'\x78'
+# Magic number starting Zstandard frames.
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+_ZSTD_LEVEL = 3
+# Prefixes of values serialized with something else than pickle. They are
+# neither pickle opcodes nor the zlib header.
+_MSGPACK_PREFIX = b'\x01'
+_ORJSON_PREFIX = b'\x02'
+
+# pybase64's SIMD encoder only pays off once the call overhead is amortized;
+# below this many bytes the standard library is faster.
+_PYBASE64_ENCODE_THRESHOLD = 128
+
+# Types whose pickled stream doesn't depend on how they are referenced, making
+# the copy done before pickling pure overhead.
+_IMMUTABLE_ATOMIC_TYPES = frozenset({
+    int, float, bool, complex, str, bytes, type(None),
+})
+
 
 class PickledObject(str):
     """
@@ -25,6 +81,21 @@ class PickledObject(str):
     """
 
 
+class _PickledStr(str):
+    """
+    Used to hold values fetched by lazy PickledObjectField until they are
+    accessed. Unlike PickledObject, it doesn't mark the value as a definite
+    pickle so that it's decoded like values of non-lazy fields.
+    """
+
+
+class _PickledBytes(bytes):
+    """
+    The binary counterpart of _PickledStr, used to hold values fetched by
+    lazy PickledBinaryField until they are accessed.
+    """
+
+
 class _ObjectWrapper:
     """
     A class used to wrap object that have properties that may clash with the
@@ -50,34 +121,175 @@ def get_default_protocol():
     return getattr(settings, 'PICKLEFIELD_DEFAULT_PROTOCOL', DEFAULT_PROTOCOL)
 
 
-def dbsafe_encode(value, compress_object=False, pickle_protocol=None, copy=True):
-    # We use deepcopy() here to avoid a problem with cPickle, where dumps
-    # can generate different character streams for same lookup value if
-    # they are referenced differently.
+# The binascii functions are used directly rather than through their
+# base64.b64encode() and b64decode() wrappers to save a Python call.
+def _b64encode(value):
+    if pybase64 is not None and len(value) >= _PYBASE64_ENCODE_THRESHOLD:
+        return pybase64.b64encode(value)
+    return b2a_base64(value, newline=False)
+
+
+def _b64decode(value):
+    if pybase64 is not None:
+        return pybase64.b64decode(value, validate=False)
+    return a2b_base64(value)
+
+
+def _is_immutable(value, depth=3):
+    """
+    Return whether ``value`` is an atomic immutable or a tuple or frozenset
+    of such values, nested at most ``depth`` levels deep.
+    """
+    value_type = type(value)
+    if value_type in _IMMUTABLE_ATOMIC_TYPES:
+        return True
+    if depth and (value_type is tuple or value_type is frozenset):
+        return all(_is_immutable(item, depth - 1) for item in value)
+    return False
+
+
+def _msgpack_dumps(value):
+    return _MSGPACK_PREFIX + msgpack.packb(value, use_bin_type=True)
+
+
+def _orjson_dumps(value):
+    return _ORJSON_PREFIX + orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+# Serializers other than pickle, only suitable for JSON-like values.
+_SERIALIZERS = {
+    'msgpack': _msgpack_dumps,
+    'orjson': _orjson_dumps,
+}
+
+
+def _zstd_compress(value):
+    # Compressors aren't thread-safe so one is created for each value.
+    return zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(value)
+
+
+_COMPRESSORS = {
+    'zlib': compress,
+    'zstd': _zstd_compress,
+}
+
+
+def _pickle(value, pickle_protocol=None, copy=True):
+    # We unpickle a first pickling of the value here to avoid a problem with
+    # cPickle, where dumps can generate different character streams for same
+    # lookup value if they are referenced differently. This used to be done
+    # with deepcopy() which produces the same streams but is implemented in
+    # Python and several times slower. pickletools.optimize() isn't an option
+    # either: it only drops unused PUT opcodes, leaving the GET opcodes of
+    # shared references in place, and is even slower than deepcopy().
     # The reason this is important is because we do all of our lookups as
     # simple string matches, thus the character streams must be the same
     # for the lookups to work properly. See tests.py for more information.
     if pickle_protocol is None:
         pickle_protocol = get_default_protocol()
-    if copy:
+    if copy and not _is_immutable(value):
         # Copy can be very expensive if users aren't going to perform lookups
         # on the value anyway.
-        value = deepcopy(value)
-    value = dumps(value, protocol=pickle_protocol)
-    if compress_object:
-        value = compress(value)
-    value = b64encode(value).decode()  # decode bytes to str
-    return PickledObject(value)
-
-
-def dbsafe_decode(value, compress_object=False):
-    value = value.encode()  # encode str to bytes
-    value = b64decode(value)
-    if compress_object:
+        value = loads(dumps(value, protocol=pickle_protocol))
+    return dumps(value, protocol=pickle_protocol)
+
+
+def _serialize(value, compress_object=False, pickle_protocol=None, copy=True,
+               serializer='pickle', algorithm='zlib'):
+    """
+    Serialize ``value`` into bytes, optionally compressing them.
+    """
+    if serializer == 'pickle':
+        value = _pickle(value, pickle_protocol, copy)
+    else:
+        value = _SERIALIZERS[serializer](value)
+    if compress_object and len(value) >= _COMPRESS_THRESHOLD:
+        value = _COMPRESSORS[algorithm](value)
+    return value
+
+
+def _require(module, name):
+    # ImproperlyConfigured isn't swallowed by PickledObjectField.to_python()
+    # so that missing packages don't make values come back undecoded.
+    if module is None:
+        raise ImproperlyConfigured(
+            'The %s package is required to decode this value.' % name
+        )
+    return module
+
+
+def _deserialize(value, serializer='pickle'):
+    """
+    Deserialize bytes produced by ``_serialize``, decompressing them if needed.
+
+    Values prefixed as msgpack or orjson payloads are only recognized when
+    ``serializer`` isn't pickle, other values are always unpickled.
+    """
+    if value[:1] == _ZLIB_MAGIC:
         value = decompress(value)
+    elif value[:4] == _ZSTD_MAGIC:
+        value = _require(zstandard, 'zstandard').ZstdDecompressor().decompress(value)
+    if serializer != 'pickle':
+        prefix = value[:1]
+        if prefix == _MSGPACK_PREFIX:
+            return _require(msgpack, 'msgpack').unpackb(value[1:], strict_map_key=False)
+        if prefix == _ORJSON_PREFIX:
+            return _require(orjson, 'orjson').loads(value[1:])
     return loads(value)
 
 
+def _dbsafe_encode(value, compress_object=False, pickle_protocol=None, copy=True,
+                   serializer='pickle', algorithm='zlib'):
+    value = _serialize(
+        value, compress_object, pickle_protocol, copy, serializer, algorithm
+    )
+    # Rebinding value releases the serialized bytes before the base64 ones are
+    # decoded, so that only two copies of the value are alive at once.
+    value = _b64encode(value)
+    return value.decode()  # decode bytes to str
+
+
+def dbsafe_encode(value, compress_object=False, pickle_protocol=None, copy=True,
+                  serializer='pickle', algorithm='zlib'):
+    return PickledObject(_dbsafe_encode(
+        value, compress_object, pickle_protocol, copy, serializer, algorithm
+    ))
+
+
+def dbsafe_decode(value, compress_object=False, serializer='pickle'):
+    # Compressed values are detected from their header, ``compress_object`` is
+    # only kept for backward compatibility.
+    if isinstance(value, str):
+        # Base64 is pure ASCII, bytes-like values are decoded as is.
+        value = value.encode('ascii')
+    value = _b64decode(value)
+    return _deserialize(value, serializer)
+
+
+class PickledObjectDescriptor(DeferredAttribute):
+    """
+    Decode the values fetched from the database by lazy fields the first time
+    they are accessed.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        field = self.field
+        if isinstance(value, field.encoded_class):
+            # Decode the raw value, stripped of its marker type, the same way
+            # from_db_value() does for non-lazy fields.
+            value = field.encoded_class.__base__(value)
+            value = instance.__dict__[field.attname] = field._decode_db_value(value)
+        return value
+
+    def __set__(self, instance, value):
+        # Defining __set__ makes this a data descriptor so that __get__ is
+        # called even once the value is stored in the instance's __dict__.
+        instance.__dict__[self.field.attname] = value
+
+
 class PickledObjectField(models.Field):
     """
     A field that will accept *any* python object and store it in the
@@ -89,6 +301,8 @@ class PickledObjectField(models.Field):
     use the ``isnull`` lookup type correctly.
     """
     empty_strings_allowed = False
+    # The type wrapping values fetched by lazy fields until they are accessed.
+    encoded_class = _PickledStr
 
     def __init__(self, *args, **kwargs):
         self.compress = kwargs.pop('compress', False)
@@ -96,9 +310,25 @@ class PickledObjectField(models.Field):
         if protocol is None:
             protocol = get_default_protocol()
         self.protocol = protocol
-        self.copy = kwargs.pop('copy', True)
+        self.copy = kwargs.pop('copy', False)
+        self.serializer = kwargs.pop('serializer', 'pickle')
+        self.algorithm = kwargs.pop('algorithm', 'zlib')
+        self.lazy = kwargs.pop('lazy', False)
+        if self.lazy:
+            # Only used by lazy fields as it slows down attribute access.
+            self.descriptor_class = PickledObjectDescriptor
         kwargs.setdefault('editable', False)
         super().__init__(*args, **kwargs)
+        # Bind the encoding options once instead of looking them up on every
+        # save as this is called for each row of bulk operations.
+        self._encode = partial(
+            _dbsafe_encode,
+            compress_object=self.compress,
+            pickle_protocol=self.protocol,
+            copy=self.copy,
+            serializer=self.serializer,
+            algorithm=self.algorithm,
+        )
 
     def get_default(self):
         """
@@ -141,9 +371,57 @@ class PickledObjectField(models.Field):
         else:
             return []
 
+    def _check_serializer(self):
+        if self.serializer == 'pickle':
+            return []
+        if self.serializer not in _SERIALIZERS:
+            return [
+                checks.Error(
+                    "'serializer' must be one of %s." % ', '.join(
+                        repr(serializer) for serializer in ['pickle', *_SERIALIZERS]
+                    ),
+                    obj=self,
+                    id='picklefield.E002',
+                )
+            ]
+        if {'msgpack': msgpack, 'orjson': orjson}[self.serializer] is None:
+            return [
+                checks.Error(
+                    "The %r serializer requires the %s package to be installed." % (
+                        self.serializer, self.serializer,
+                    ),
+                    obj=self,
+                    id='picklefield.E003',
+                )
+            ]
+        return []
+
+    def _check_algorithm(self):
+        if self.algorithm not in _COMPRESSORS:
+            return [
+                checks.Error(
+                    "'algorithm' must be one of %s." % ', '.join(
+                        repr(algorithm) for algorithm in _COMPRESSORS
+                    ),
+                    obj=self,
+                    id='picklefield.E004',
+                )
+            ]
+        if self.algorithm == 'zstd' and zstandard is None:
+            return [
+                checks.Error(
+                    "The 'zstd' algorithm requires the zstandard package to be installed.",
+                    obj=self,
+                    id='picklefield.E005',
+                )
+            ]
+        return []
+
     def check(self, **kwargs):
         errors = super().check(**kwargs)
         errors.extend(self._check_default())
+        errors.extend(self._check_serializer())
+        errors.extend(self._check_algorithm())
         return errors
 
     def deconstruct(self):
@@ -152,6 +430,14 @@ class PickledObjectField(models.Field):
             kwargs['compress'] = True
         if self.protocol != get_default_protocol():
             kwargs['protocol'] = self.protocol
+        if self.copy:
+            kwargs['copy'] = True
+        if self.serializer != 'pickle':
+            kwargs['serializer'] = self.serializer
+        if self.algorithm != 'zlib':
+            kwargs['algorithm'] = self.algorithm
+        if self.lazy:
+            kwargs['lazy'] = True
         return name, path, args, kwargs
 
     def to_python(self, value):
@@ -166,7 +452,9 @@ class PickledObjectField(models.Field):
         """
         if value is not None:
             try:
-                value = dbsafe_decode(value, self.compress)
+                value = dbsafe_decode(value, self.compress, self.serializer)
+            except ImproperlyConfigured:
+                raise
             except Exception:
                 # If the value is a definite pickle; and an error is raised in
                 # de-pickling it should be allowed to propagate.
@@ -178,31 +466,42 @@ class PickledObjectField(models.Field):
         return value
 
     def pre_save(self, model_instance, add):
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, self.encoded_class):
+            # Avoid decoding values of lazy fields that were never accessed.
+            return value
         value = super().pre_save(model_instance, add)
         return wrap_conflictual_object(value)
 
-    def from_db_value(self, value, expression, connection):
+    def _decode_db_value(self, value):
         return self.to_python(value)
 
+    def from_db_value(self, value, expression, connection):
+        if self.lazy:
+            # Defer decoding to PickledObjectDescriptor.
+            if value is not None:
+                value = self.encoded_class(value)
+            return value
+        return self._decode_db_value(value)
+
     def get_db_prep_value(self, value, connection=None, prepared=False):
         """
         Pickle and b64encode the object, optionally compressing it.
 
-        The pickling protocol is specified explicitly (by default 2),
+        The pickling protocol is specified explicitly (by default 5),
         rather than as -1 or HIGHEST_PROTOCOL, because we don't want the
         protocol to change over time. If it did, ``exact`` and ``in``
         lookups would likely fail, since pickle would now be generating
         a different string.
 
         """
-        if value is not None and not isinstance(value, PickledObject):
-            # We call force_str here explicitly, so that the encoded string
-            # isn't rejected by the postgresql_psycopg2 backend. Alternatively,
-            # we could have just registered PickledObject with the psycopg
-            # marshaller (telling it to store it like it would a string), but
-            # since both of these methods result in the same value being stored,
-            # doing things this way is much easier.
-            value = force_str(dbsafe_encode(value, self.compress, self.protocol, self.copy))
+        if value is not None and not isinstance(value, (PickledObject, _PickledStr)):
+            # The encoded value is a plain string rather than a PickledObject,
+            # so that it isn't rejected by the postgresql_psycopg2 backend and
+            # to avoid instantiating a str subclass for every saved value.
+            # The PickledObject type is only needed to recognize values that
+            # were encoded beforehand.
+            value = self._encode(value)
         return value
 
     def value_to_string(self, obj):
@@ -219,3 +518,57 @@ class PickledObjectField(models.Field):
         if lookup_name not in ['exact', 'in', 'isnull']:
             raise TypeError('Lookup type %s is not supported.' % lookup_name)
         return super().get_lookup(lookup_name)
+
+
+class PickledBinaryField(PickledObjectField):
+    """
+    A PickledObjectField storing the pickled bytes in a binary column.
+
+    Unlike PickledObjectField values aren't base64 encoded which makes them
+    smaller and faster to save and load. The values are still serialized as
+    base64 encoded strings though.
+    """
+    encoded_class = _PickledBytes
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._serialize = partial(
+            _serialize,
+            compress_object=self.compress,
+            pickle_protocol=self.protocol,
+            copy=self.copy,
+            serializer=self.serializer,
+            algorithm=self.algorithm,
+        )
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            # Serialized values are base64 encoded strings.
+            return super().to_python(value)
+        # Other values, e.g. bytes assigned by users, can't be told apart from
+        # pickles and are left untouched. Values fetched from the database are
+        # decoded by from_db_value().
+        return value
+
+    def _decode_db_value(self, value):
+        if value is not None:
+            value = _deserialize(value, self.serializer)
+            if isinstance(value, _ObjectWrapper):
+                return value._obj
+        return value
+
+    def get_db_prep_value(self, value, connection=None, prepared=False):
+        if value is not None:
+            if isinstance(value, PickledObject):
+                value = _b64decode(value.encode('ascii'))
+            elif not isinstance(value, _PickledBytes):
+                value = self._serialize(value)
+            value = connection.Database.Binary(value)
+        return value
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return super().get_db_prep_value(value)
+
+    def get_internal_type(self):
+        return 'BinaryField'
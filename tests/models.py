@@ -1,7 +1,7 @@
 from datetime import date
 
 from django.db import models
-from picklefield import PickledObjectField
+from picklefield import PickledBinaryField, PickledObjectField
 
 S1 = 'Hello World'
 T1 = (1, 2, 3, 4, 5)
@@ -11,8 +11,7 @@ D2 = {1: 2, 2: 4, 3: 6, 4: 8, 5: 10}
 
 
 class TestCopyDataType(str):
-    def __deepcopy__(self, memo):
-        raise ValueError('Please dont copy me')
+    pass
 
 
 class TestCustomDataType(str):
@@ -20,8 +19,8 @@ class TestCustomDataType(str):
 
 
 class TestingModel(models.Model):
-    pickle_field = PickledObjectField()
-    compressed_pickle_field = PickledObjectField(compress=True)
+    pickle_field = PickledObjectField(copy=True)
+    compressed_pickle_field = PickledObjectField(compress=True, copy=True)
     default_pickle_field = PickledObjectField(default=(D1, S1, T1, L1))
     callable_pickle_field = PickledObjectField(default=date.today)
     non_copying_field = PickledObjectField(copy=False, default=TestCopyDataType('boom!'))
@@ -30,3 +29,14 @@ class TestingModel(models.Model):
 
 class MinimalTestingModel(models.Model):
     pickle_field = PickledObjectField()
+
+
+class BinaryTestingModel(models.Model):
+    pickle_field = PickledBinaryField(copy=True)
+    compressed_pickle_field = PickledBinaryField(compress=True, copy=True)
+    nullable_pickle_field = PickledBinaryField(null=True)
+
+
+class LazyTestingModel(models.Model):
+    pickle_field = PickledObjectField(lazy=True, null=True)
+    binary_pickle_field = PickledBinaryField(lazy=True, null=True)
@@ -1,15 +1,26 @@
 import json
+from base64 import b64decode, b64encode, encodebytes
+from copy import deepcopy
 from datetime import date
+from pickle import UnpicklingError, dumps, loads
+from unittest import skipUnless
 from unittest.mock import patch
 
 from django.core import checks, serializers
+from django.core.exceptions import ImproperlyConfigured
 from django.db import IntegrityError, models
 from django.test import SimpleTestCase, TestCase
 from django.test.utils import isolate_apps
+from picklefield import DEFAULT_PROTOCOL
 from picklefield.fields import (
+    PickledBinaryField,
     PickledObjectField,
+    dbsafe_decode,
     dbsafe_encode,
+    msgpack,
+    orjson,
     wrap_conflictual_object,
+    zstandard,
 )
 
 from .models import (
@@ -18,6 +29,8 @@ from .models import (
     L1,
     S1,
     T1,
+    BinaryTestingModel,
+    LazyTestingModel,
     MinimalTestingModel,
     TestCopyDataType,
     TestCustomDataType,
@@ -62,6 +75,8 @@ class PickledObjectFieldTests(TestCase):
         model_test = TestingModel.objects.get(id__exact=model_test.pk)
         self.assertEqual((D1, S1, T1, L1), model_test.default_pickle_field)
         self.assertEqual(date.today(), model_test.callable_pickle_field)
+        self.assertEqual(TestCopyDataType("boom!"), model_test.non_copying_field)
+        self.assertIs(type(model_test.non_copying_field), TestCopyDataType)
 
     def test_lookups(self):
         """
@@ -193,23 +208,40 @@ class PickledObjectFieldTests(TestCase):
             self.assertEqual(deserialized_test.object, model)
 
     def test_no_copy(self):
-        TestingModel.objects.create(
-            pickle_field="Copy Me",
-            compressed_pickle_field="Copy Me",
-            non_copying_field=TestCopyDataType("Dont Copy Me"),
-        )
-
-        with self.assertRaises(ValueError):
+        # Copies are made by unpickling a first pickling of the value.
+        with patch("picklefield.fields.loads", side_effect=loads) as mocked:
+            model = TestingModel.objects.create(
+                pickle_field="Copy Me",
+                compressed_pickle_field="Copy Me",
+                non_copying_field=TestCopyDataType("Dont Copy Me"),
+            )
+            mocked.assert_not_called()
             TestingModel.objects.create(
-                pickle_field=TestCopyDataType("BOOM!"),
+                pickle_field=TestCopyDataType("Copy Me"),
                 compressed_pickle_field="Copy Me",
                 non_copying_field="Dont copy me",
             )
+            mocked.assert_called_once()
+        model = TestingModel.objects.get(pk=model.pk)
+        self.assertEqual(model.non_copying_field, TestCopyDataType("Dont Copy Me"))
+        self.assertIs(type(model.non_copying_field), TestCopyDataType)
+        self.assertEqual(TestingModel().non_copying_field, "boom!")
+
+    def test_copy_default(self):
+        self.assertIs(PickledObjectField().copy, False)
 
     def test_empty_strings_not_allowed(self):
         with self.assertRaises(IntegrityError):
             MinimalTestingModel.objects.create()
 
+    def test_get_db_prep_value(self):
+        field = PickledObjectField()
+        encoded = field.get_db_prep_value(D1)
+        self.assertIs(type(encoded), str)
+        self.assertEqual(encoded, dbsafe_encode(D1))
+        pre_encoded = dbsafe_encode(D1)
+        self.assertIs(field.get_db_prep_value(pre_encoded), pre_encoded)
+
     def test_decode_error(self):
         def mock_decode_error(*args, **kwargs):
             raise Exception()
@@ -228,7 +260,275 @@ class PickledObjectFieldTests(TestCase):
             )
 
 
+class PickledBinaryFieldTests(TestCase):
+    def setUp(self):
+        self.testing_data = (
+            D2,
+            S1,
+            T1,
+            L1,
+            TestCustomDataType(S1),
+            MinimalTestingModel,
+            list(range(1000)),
+        )
+        return super().setUp()
+
+    def test_data_integrity(self):
+        for value in self.testing_data:
+            model_test = BinaryTestingModel.objects.create(
+                pickle_field=value, compressed_pickle_field=value
+            )
+            model_test = BinaryTestingModel.objects.get(pk=model_test.pk)
+            self.assertEqual(value, model_test.pickle_field)
+            self.assertEqual(value, model_test.compressed_pickle_field)
+            self.assertIsNone(model_test.nullable_pickle_field)
+            model_test.save()
+            model_test.delete()
+
+    def test_lookups(self):
+        for value in self.testing_data:
+            model_test = BinaryTestingModel.objects.create(
+                pickle_field=value, compressed_pickle_field=value
+            )
+            wrapped_value = wrap_conflictual_object(value)
+            self.assertEqual(
+                BinaryTestingModel.objects.get(
+                    pickle_field__exact=wrapped_value,
+                    compressed_pickle_field__in=[wrapped_value],
+                ),
+                model_test,
+            )
+            self.assertEqual(
+                BinaryTestingModel.objects.filter(nullable_pickle_field__isnull=True).count(), 1
+            )
+            model_test.delete()
+
+    def test_serialization(self):
+        model = BinaryTestingModel(
+            pk=1, pickle_field={"foo": "bar"}, compressed_pickle_field=L1
+        )
+        serialized = serializers.serialize("json", [model])
+        fields = json.loads(serialized)[0]["fields"]
+        self.assertEqual(fields["pickle_field"], dbsafe_encode({"foo": "bar"}))
+        for deserialized_test in serializers.deserialize("json", serialized):
+            self.assertEqual(deserialized_test.object.pickle_field, {"foo": "bar"})
+            self.assertEqual(deserialized_test.object.compressed_pickle_field, L1)
+
+    def test_pre_encoded_value(self):
+        model_test = BinaryTestingModel.objects.create(
+            pickle_field=dbsafe_encode(D1), compressed_pickle_field=L1
+        )
+        self.assertEqual(BinaryTestingModel.objects.get(pk=model_test.pk).pickle_field, D1)
+
+    def test_bytes_value(self):
+        for value in (b"hello", dumps([1, 2])):
+            model_test = BinaryTestingModel(pickle_field=value, compressed_pickle_field=value)
+            model_test.full_clean()
+            self.assertEqual(model_test.pickle_field, value)
+            model_test.save()
+            model_test = BinaryTestingModel.objects.get(pk=model_test.pk)
+            self.assertEqual(model_test.pickle_field, value)
+            self.assertEqual(model_test.compressed_pickle_field, value)
+
+    def test_internal_type(self):
+        self.assertEqual(PickledBinaryField().get_internal_type(), "BinaryField")
+
+
+class LazyPickledObjectFieldTests(TestCase):
+    def test_decoded_on_access(self):
+        model = LazyTestingModel.objects.create(pickle_field=D1, binary_pickle_field=L1)
+        model = LazyTestingModel.objects.get(pk=model.pk)
+        self.assertIsInstance(model.__dict__["pickle_field"], str)
+        with patch(
+            "picklefield.fields._deserialize",
+            side_effect=lambda value, serializer: loads(value),
+        ) as deserialize:
+            self.assertEqual(model.pickle_field, D1)
+            self.assertEqual(model.pickle_field, D1)
+            self.assertEqual(model.binary_pickle_field, L1)
+            self.assertEqual(deserialize.call_count, 2)
+
+    def test_null(self):
+        model = LazyTestingModel.objects.create()
+        model = LazyTestingModel.objects.get(pk=model.pk)
+        self.assertIsNone(model.pickle_field)
+        self.assertIsNone(model.binary_pickle_field)
+
+    def test_save_without_access(self):
+        model = LazyTestingModel.objects.create(pickle_field=D1, binary_pickle_field=L1)
+        model = LazyTestingModel.objects.get(pk=model.pk)
+        with patch("picklefield.fields._deserialize") as deserialize:
+            model.save()
+            deserialize.assert_not_called()
+        model = LazyTestingModel.objects.get(pk=model.pk)
+        self.assertEqual(model.pickle_field, D1)
+        self.assertEqual(model.binary_pickle_field, L1)
+
+    def test_values(self):
+        LazyTestingModel.objects.create(pickle_field=D1)
+        encoded = LazyTestingModel.objects.values_list("pickle_field", flat=True).get()
+        self.assertIsInstance(encoded, str)
+        self.assertEqual(dbsafe_decode(encoded), D1)
+
+    def test_non_pickle_value(self):
+        """
+        Values that can't be decoded are returned as is, like non-lazy fields
+        do.
+        """
+        model = LazyTestingModel.objects.create()
+        LazyTestingModel.objects.update(pickle_field=models.Value("not a pickle"))
+        model = LazyTestingModel.objects.get(pk=model.pk)
+        self.assertIs(type(model.pickle_field), str)
+        self.assertEqual(model.pickle_field, "not a pickle")
+
+    def test_pre_encoded_value(self):
+        """
+        Assigned pre-encoded values aren't decoded until they are saved and
+        fetched again, like non-lazy fields.
+        """
+        encoded = dbsafe_encode(D1)
+        model = LazyTestingModel(pickle_field=encoded)
+        self.assertEqual(model.pickle_field, encoded)
+        model.save()
+        self.assertEqual(model.pickle_field, encoded)
+        self.assertEqual(LazyTestingModel.objects.get(pk=model.pk).pickle_field, D1)
+
+    def test_deconstruct(self):
+        self.assertIs(PickledObjectField(lazy=True).deconstruct()[3]["lazy"], True)
+        self.assertNotIn("lazy", PickledObjectField().deconstruct()[3])
+
+
+class DbsafeEncodingTests(SimpleTestCase):
+    def test_pybase64_fallback(self):
+        """
+        The encoded values must not depend on whether pybase64 is available.
+        """
+        for value in (S1, L1, D1, list(range(1000))):
+            encoded = dbsafe_encode(value)
+            with patch("picklefield.fields.pybase64", None):
+                self.assertEqual(dbsafe_encode(value), encoded)
+                self.assertEqual(dbsafe_decode(encoded), value)
+            self.assertEqual(dbsafe_decode(encoded), value)
+
+    def test_immutable_values_not_copied(self):
+        with patch("picklefield.fields.loads", side_effect=loads) as mocked:
+            for value in (1, 1.5, True, None, S1, b"bytes", T1, (S1, (T1, None)), frozenset(T1)):
+                dbsafe_encode(value)
+            mocked.assert_not_called()
+            for value in (L1, D1, (S1, L1), TestCustomDataType(S1)):
+                dbsafe_encode(value)
+            self.assertEqual(mocked.call_count, 4)
+
+    def test_compression(self):
+        small, large = S1, list(range(1000))
+        self.assertEqual(dbsafe_encode(small, compress_object=True), dbsafe_encode(small))
+        encoded = dbsafe_encode(large, compress_object=True)
+        self.assertEqual(b64decode(encoded)[:1], b"x")
+        self.assertLess(len(encoded), len(dbsafe_encode(large)))
+        # Compression is detected regardless of ``compress_object``.
+        self.assertEqual(dbsafe_decode(encoded), large)
+        self.assertEqual(dbsafe_decode(dbsafe_encode(small), compress_object=True), small)
+
+    def test_copy_matches_deepcopy(self):
+        """
+        Copying through pickling must produce the same streams deepcopy() did
+        so that lookups keep matching values stored by previous versions.
+        """
+        shared = [S1]
+        for value in ((D1, S1, T1, L1), [shared, shared, [shared]], {S1: {1, 2}}):
+            self.assertEqual(
+                b64decode(dbsafe_encode(value)),
+                dumps(deepcopy(value), protocol=DEFAULT_PROTOCOL),
+            )
+
+    @skipUnless(zstandard, "zstandard is not installed")
+    def test_zstd_compression(self):
+        value = list(range(1000))
+        encoded = dbsafe_encode(value, compress_object=True, algorithm="zstd")
+        self.assertEqual(b64decode(encoded)[:4], b"\x28\xb5\x2f\xfd")
+        self.assertEqual(dbsafe_decode(encoded), value)
+        self.assertEqual(dbsafe_encode(S1, compress_object=True, algorithm="zstd"), dbsafe_encode(S1))
+        field = PickledBinaryField(compress=True, algorithm="zstd")
+        self.assertEqual(field.from_db_value(field._serialize(value), None, None), value)
+        self.assertEqual(field.deconstruct()[3]["algorithm"], "zstd")
+        self.assertNotIn("algorithm", PickledObjectField().deconstruct()[3])
+        # Fields not declared with algorithm="zstd" can read zstd values too,
+        # which requires zstandard to be installed.
+        with patch("picklefield.fields.zstandard", None):
+            msg = "The zstandard package is required to decode this value."
+            with self.assertRaisesMessage(ImproperlyConfigured, msg):
+                PickledObjectField().to_python(encoded)
+
+    def test_decode_bytes(self):
+        encoded = dbsafe_encode(D1)
+        self.assertEqual(dbsafe_decode(encoded.encode()), D1)
+        self.assertEqual(dbsafe_decode(memoryview(encoded.encode())), D1)
+
+    def test_decode_line_breaks(self):
+        """
+        Values wrapped over multiple lines, e.g. by database dumps, decode.
+        """
+        value = list(range(1000))
+        encoded = encodebytes(b64decode(dbsafe_encode(value))).decode()
+        self.assertIn("\n", encoded)
+        self.assertEqual(dbsafe_decode(encoded), value)
+        with patch("picklefield.fields.pybase64", None):
+            self.assertEqual(dbsafe_decode(encoded), value)
+
+    def test_default_protocol(self):
+        self.assertEqual(b64decode(dbsafe_encode(D1))[:2], b"\x80\x05")
+        with self.settings(PICKLEFIELD_DEFAULT_PROTOCOL=2):
+            self.assertEqual(b64decode(dbsafe_encode(D1))[:2], b"\x80\x02")
+
+
+class SerializerTests(SimpleTestCase):
+    value = {"list": L1, "str": S1, "nested": {"float": 1.5, "none": None}}
+
+    def assertRoundTrip(self, serializer):
+        for compress_object in (False, True):
+            for value in (self.value, [self.value] * 100):
+                encoded = dbsafe_encode(
+                    value, compress_object=compress_object, serializer=serializer
+                )
+                self.assertEqual(dbsafe_decode(encoded, serializer=serializer), value)
+                # Fields using pickle don't recognize other serializers.
+                with self.assertRaises(UnpicklingError):
+                    dbsafe_decode(encoded)
+        field = PickledObjectField(serializer=serializer)
+        self.assertEqual(field.to_python(field.get_db_prep_value(self.value)), self.value)
+        self.assertEqual(field.deconstruct()[3]["serializer"], serializer)
+
+    @skipUnless(orjson, "orjson is not installed")
+    def test_pickle_field_fallback(self):
+        # b"\x02123" would be a valid orjson payload.
+        self.assertEqual(PickledObjectField().to_python("AjEyMw=="), "AjEyMw==")
+
+    def test_missing_package(self):
+        encoded = b64encode(b"\x01\x90").decode()
+        field = PickledObjectField(serializer="msgpack")
+        with patch("picklefield.fields.msgpack", None):
+            msg = "The msgpack package is required to decode this value."
+            with self.assertRaisesMessage(ImproperlyConfigured, msg):
+                field.to_python(encoded)
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack(self):
+        self.assertRoundTrip("msgpack")
+
+    @skipUnless(orjson, "orjson is not installed")
+    def test_orjson(self):
+        self.assertRoundTrip("orjson")
+
+    def test_pickle(self):
+        self.assertNotIn("serializer", PickledObjectField().deconstruct()[3])
+        self.assertEqual(dbsafe_encode(self.value, serializer="pickle"), dbsafe_encode(self.value))
+
+
 class PickledObjectFieldDeconstructTests(SimpleTestCase):
+    def test_copy(self):
+        self.assertNotIn("copy", PickledObjectField().deconstruct()[3])
+        self.assertIs(PickledObjectField(copy=True).deconstruct()[3]["copy"], True)
+
     def test_protocol(self):
         field = PickledObjectField()
         self.assertNotIn("protocol", field.deconstruct()[3])
@@ -277,6 +577,60 @@ class PickledObjectFieldCheckTests(SimpleTestCase):
             ],
         )
 
+    def test_serializer_check(self):
+        class Model(models.Model):
+            unknown_field = PickledObjectField(serializer="json")
+            msgpack_field = PickledObjectField(serializer="msgpack")
+
+        self.assertEqual(
+            Model._meta.get_field("unknown_field").check(),
+            [
+                checks.Error(
+                    msg="'serializer' must be one of 'pickle', 'msgpack', 'orjson'.",
+                    obj=Model._meta.get_field("unknown_field"),
+                    id="picklefield.E002",
+                ),
+            ],
+        )
+        with patch("picklefield.fields.msgpack", None):
+            self.assertEqual(
+                Model._meta.get_field("msgpack_field").check(),
+                [
+                    checks.Error(
+                        msg="The 'msgpack' serializer requires the msgpack package to be installed.",
+                        obj=Model._meta.get_field("msgpack_field"),
+                        id="picklefield.E003",
+                    ),
+                ],
+            )
+
+    def test_algorithm_check(self):
+        class Model(models.Model):
+            unknown_field = PickledObjectField(compress=True, algorithm="lzma")
+            zstd_field = PickledObjectField(compress=True, algorithm="zstd")
+
+        self.assertEqual(
+            Model._meta.get_field("unknown_field").check(),
+            [
+                checks.Error(
+                    msg="'algorithm' must be one of 'zlib', 'zstd'.",
+                    obj=Model._meta.get_field("unknown_field"),
+                    id="picklefield.E004",
+                ),
+            ],
+        )
+        with patch("picklefield.fields.zstandard", None):
+            self.assertEqual(
+                Model._meta.get_field("zstd_field").check(),
+                [
+                    checks.Error(
+                        msg="The 'zstd' algorithm requires the zstandard package to be installed.",
+                        obj=Model._meta.get_field("zstd_field"),
+                        id="picklefield.E005",
+                    ),
+                ],
+            )
+
     def test_non_mutable_default_check(self):
         class Model(models.Model):
             list_field = PickledObjectField(default=list)